@@ -1,49 +1,274 @@
 import os
+import asyncio
 import hmac
 import hashlib
-from typing import Optional
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from database import db, create_document, get_documents
-from schemas import Product, Order, Shipment
-import requests
+import threading
+import time
+from typing import List, Optional, get_args, get_origin
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+import fastjsonschema
+import orjson
+from database import db, create_document, create_documents, get_cursor
+from schemas import User, Product, OrderItem, Order, Shipment
+import httpx
 from bson import ObjectId
 
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID", "")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET", "")
 
-app = FastAPI(title="Luxury Perfume Store API")
+# HMAC-SHA256 pads derived once at import, so verify_payment only runs the two
+# C-level sha256 passes per request instead of rebuilding an hmac object
+_HMAC_IPAD = _HMAC_OPAD = b""
+if RAZORPAY_KEY_SECRET:
+    _hmac_key = RAZORPAY_KEY_SECRET.encode()
+    if len(_hmac_key) > 64:
+        _hmac_key = hashlib.sha256(_hmac_key).digest()
+    _hmac_key = _hmac_key.ljust(64, b"\x00")
+    _HMAC_IPAD = bytes(b ^ 0x36 for b in _hmac_key)
+    _HMAC_OPAD = bytes(b ^ 0x5c for b in _hmac_key)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+# orjson serializes datetime natively and is much faster than stdlib json
+app = FastAPI(title="Luxury Perfume Store API", default_response_class=ORJSONResponse)
+
+# Allowed CORS origins as a frozenset of header bytes; "*" keeps the previous
+# echo-any-origin behaviour until a production frontend origin is pinned
+CORS_ALLOW_ORIGINS = frozenset(
+    o.strip().encode() for o in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",") if o.strip()
+)
+_CORS_ALLOW_ANY = b"*" in CORS_ALLOW_ORIGINS
+_CORS_PREFLIGHT_HEADERS = (
+    (b"access-control-allow-methods", b"*"),
+    (b"access-control-allow-headers", b"*"),
+    (b"access-control-allow-credentials", b"true"),
+    (b"access-control-max-age", b"600"),
+    (b"vary", b"origin"),
+)
+_CORS_SIMPLE_HEADERS = (
+    (b"access-control-allow-credentials", b"true"),
+    (b"vary", b"origin"),
 )
 
+class FastCORSMiddleware:
+    """Hard-coded CORS fast path: one header scan, frozenset origin check,
+    preflight answered from precomputed headers"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        origin = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+                break
+        if origin is None or not (_CORS_ALLOW_ANY or origin in CORS_ALLOW_ORIGINS):
+            # Not a CORS request, or origin not allowed: pass through untouched
+            await self.app(scope, receive, send)
+            return
+        if scope["method"] == "OPTIONS":
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"access-control-allow-origin", origin), *_CORS_PREFLIGHT_HEADERS],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *(message.get("headers") or ()),
+                    (b"access-control-allow-origin", origin),
+                    *_CORS_SIMPLE_HEADERS,
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+app.add_middleware(FastCORSMiddleware)
+
+# Shared HTTP client so TCP/TLS connections to Razorpay are pooled across requests
+razorpay_client: Optional[httpx.AsyncClient] = None
+
+@app.on_event("startup")
+async def startup_http_client():
+    global razorpay_client
+    razorpay_client = httpx.AsyncClient(
+        timeout=15,
+        auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET),
+        transport=httpx.AsyncHTTPTransport(
+            retries=2,
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=50),
+        ),
+    )
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    if razorpay_client is not None:
+        await razorpay_client.aclose()
+
+@app.on_event("startup")
+async def startup_database():
+    if db is None:
+        return
+    # Warm a pooled connection so the first user request doesn't pay the handshake
+    await db.command("ping")
+    # verify_payment filters on razorpay_order_id; without this it's a collection scan.
+    # Partial, not sparse: inserted orders carry razorpay_order_id: null and sparse
+    # unique indexes treat explicit nulls as duplicates
+    await db["order"].create_index(
+        "razorpay_order_id",
+        unique=True,
+        partialFilterExpression={"razorpay_order_id": {"$type": "string"}},
+    )
+    await db["order"].create_index("status")
+
+# Default field sets for the list endpoints; callers can narrow or widen them
+# with ?fields=... to cut BSON-over-wire and JSON output bytes
+DEFAULT_PRODUCT_FIELDS = "title,brand,price,images,in_stock"
+DEFAULT_ORDER_FIELDS = ("customer_name,customer_email,customer_phone,shipping_address,"
+                        "items,subtotal,shipping_fee,total_amount,currency,status,created_at")
+DEFAULT_SHIPMENT_FIELDS = "order_id,provider,tracking_id,status,created_at"
+
+# 4KB CSPRNG pool for receipt nonces, refilled when exhausted: one getrandom(2)
+# syscall per ~1024 orders instead of one per order
+_NONCE_POOL_SIZE = 4096
+_nonce_pool = bytearray(os.urandom(_NONCE_POOL_SIZE))
+_nonce_ptr = 0
+_nonce_lock = threading.Lock()
+
+def _nonce4():
+    global _nonce_ptr
+    with _nonce_lock:
+        if _nonce_ptr + 4 > _NONCE_POOL_SIZE:
+            _nonce_pool[:] = os.urandom(_NONCE_POOL_SIZE)
+            _nonce_ptr = 0
+        nonce = bytes(_nonce_pool[_nonce_ptr:_nonce_ptr + 4])
+        _nonce_ptr += 4
+    return nonce.hex()
+
+def _construct(model, data):
+    """model_construct the model, recursing into fields declared as nested models"""
+    values = dict(data)
+    for name, field in model.model_fields.items():
+        if name not in values:
+            continue
+        ann = field.annotation
+        if isinstance(ann, type) and issubclass(ann, BaseModel):
+            values[name] = _construct(ann, values[name])
+        elif get_origin(ann) is list:
+            args = get_args(ann)
+            if args and isinstance(args[0], type) and issubclass(args[0], BaseModel):
+                values[name] = [_construct(args[0], v) for v in values[name]]
+    return model.model_construct(**values)
+
+def fast_body(model):
+    """Dependency that validates the raw body with a validator precompiled at import
+    time by fastjsonschema, then builds the model via model_construct so Pydantic
+    does not re-validate field by field."""
+    validator = fastjsonschema.compile(model.model_json_schema())
+
+    async def dependency(request: Request):
+        try:
+            payload = orjson.loads(await request.body())
+        except orjson.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        try:
+            validator(payload)
+        except fastjsonschema.JsonSchemaException as e:
+            raise HTTPException(status_code=422, detail=e.message)
+        return _construct(model, payload)
+
+    return dependency
+
+# /test is hit by monitoring; cache the listCollections round-trip for 30s
+_DB_NAME = db.name if (db is not None and hasattr(db, 'name')) else "✅ Connected"
+_COLLECTIONS_TTL = 30.0
+_collections_cache = (0.0, None)
+
+async def _cached_collection_names():
+    global _collections_cache
+    ts, cached = _collections_cache
+    if cached is None or time.monotonic() - ts > _COLLECTIONS_TTL:
+        cached = await db.list_collection_names()
+        _collections_cache = (time.monotonic(), cached)
+    return cached
+
+def _parse_fields(fields):
+    """Validate a ?fields= query param into a list of plain field names.
+
+    Rejects operator-like and dotted names up front with a 400; by the time the
+    projection reaches Mongo the response is already streaming, so a bad name
+    would otherwise surface as a truncated NDJSON body instead of an error."""
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    if not names:
+        raise HTTPException(status_code=400, detail="fields must name at least one field")
+    for name in names:
+        if name.startswith("$") or "." in name:
+            raise HTTPException(status_code=400, detail=f"Invalid field name: {name}")
+    return names
+
+def _str_id_projection(fields):
+    """Projection that stringifies _id server-side, so no Python-level ObjectId loop is needed"""
+    projection = {f: 1 for f in fields}
+    projection["_id"] = 0
+    projection["id"] = {"$toString": "$_id"}
+    return projection
+
+def _ndjson_stream(cursor):
+    """Stream one JSON document per line; holds at most a cursor batch in memory"""
+    async def gen():
+        async for doc in cursor:
+            # default=str only fires for types orjson can't encode (e.g. a stray
+            # ObjectId when a caller projects raw _id); the common path stays C-only
+            yield orjson.dumps(doc, default=str) + b"\n"
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+# Model JSON schemas generated once at import; Pydantic's reflection pass is
+# too slow to rerun per request (the Flames database viewer polls this)
+SCHEMAS_JSON = orjson.dumps({
+    "User": User.model_json_schema(),
+    "Product": Product.model_json_schema(),
+    "OrderItem": OrderItem.model_json_schema(),
+    "Order": Order.model_json_schema(),
+    "Shipment": Shipment.model_json_schema(),
+})
+
+@app.get("/schema")
+async def schema():
+    return Response(SCHEMAS_JSON, media_type="application/json")
+
+# Constant bodies rendered once at import instead of per hit
+_ROOT_RESPONSE = ORJSONResponse({"status": "ok", "service": "perfume-store-api"})
+_TEST_BASE = {
+    "backend": "✅ Running",
+    "database": "❌ Not Available",
+    "database_url": None,
+    "database_name": None,
+    "connection_status": "Not Connected",
+    "collections": []
+}
+_DATABASE_URL_STATUS = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+
 @app.get("/")
-def root():
-    return {"status": "ok", "service": "perfume-store-api"}
+async def root():
+    return _ROOT_RESPONSE
 
 @app.get("/test")
-def test_database():
-    response = {
-        "backend": "✅ Running",
-        "database": "❌ Not Available",
-        "database_url": None,
-        "database_name": None,
-        "connection_status": "Not Connected",
-        "collections": []
-    }
+async def test_database():
+    response = dict(_TEST_BASE)
     try:
         if db is not None:
             response["database"] = "✅ Connected & Working"
-            response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
+            response["database_url"] = _DATABASE_URL_STATUS
+            response["database_name"] = _DB_NAME
             try:
-                collections = db.list_collection_names()
+                collections = await _cached_collection_names()
                 response["collections"] = collections[:10]
             except Exception as e:
                 response["database"] = f"⚠️  Connected but Error: {str(e)[:80]}"
@@ -55,20 +280,21 @@ def test_database():
 
 # ---------- Products ----------
 @app.post("/api/products")
-def create_product(product: Product):
+async def create_product(product: Product = Depends(fast_body(Product))):
     try:
-        _id = create_document("product", product)
+        _id = await create_document("product", product)
         return {"_id": _id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/products")
-def list_products(limit: Optional[int] = 50):
+async def list_products(limit: int = 50, fields: str = DEFAULT_PRODUCT_FIELDS):
+    projection = _str_id_projection(_parse_fields(fields))
     try:
-        items = get_documents("product", {}, limit)
-        for i in items:
-            i["_id"] = str(i.get("_id"))
-        return items
+        cursor = get_cursor("product", {}, limit,
+                            projection=projection,
+                            batch_size=min(limit, 100))
+        return _ndjson_stream(cursor)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -77,80 +303,125 @@ class CreateOrderPayload(BaseModel):
     order: Order
 
 @app.post("/api/orders")
-def create_order(payload: CreateOrderPayload):
+async def create_order(payload: CreateOrderPayload = Depends(fast_body(CreateOrderPayload))):
     order = payload.order
     if not RAZORPAY_KEY_ID or not RAZORPAY_KEY_SECRET:
         # Allow creation without payment intent for demo
         try:
-            _id = create_document("order", order)
+            _id = await create_document("order", order)
             return {"order_id": _id, "razorpay": "not_configured"}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    # Create Razorpay order
+    # Create Razorpay order; the Mongo insert doesn't need the Razorpay id up
+    # front, so run both legs concurrently and patch the id in afterwards
     try:
-        amount_paise = int(order.total_amount * 100)
-        r = requests.post(
+        amount_paise = order.total_amount
+        razorpay_call = razorpay_client.post(
             "https://api.razorpay.com/v1/orders",
-            auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET),
             json={
                 "amount": amount_paise,
                 "currency": order.currency,
-                "receipt": "rcpt_" + os.urandom(4).hex(),
+                "receipt": "rcpt_" + _nonce4(),
                 "payment_capture": 1
-            },
-            timeout=15
+            }
         )
+        r, _id = await asyncio.gather(razorpay_call, create_document("order", order),
+                                      return_exceptions=True)
+        if isinstance(_id, BaseException):
+            raise _id
+        if isinstance(r, BaseException):
+            # Razorpay timed out or refused the connection; don't leave the
+            # already-inserted order dangling in pending
+            await db["order"].update_one({"_id": ObjectId(_id)}, {"$set": {"status": "cancelled"}})
+            raise r
         if r.status_code >= 300:
+            await db["order"].update_one({"_id": ObjectId(_id)}, {"$set": {"status": "cancelled"}})
             raise HTTPException(status_code=502, detail=r.text)
-        data = r.json()
-        order.razorpay_order_id = data.get("id")
-        _id = create_document("order", order)
-        return {"order_id": _id, "razorpay_order_id": order.razorpay_order_id, "amount": amount_paise}
+        razorpay_order_id = r.json().get("id")
+        await db["order"].update_one({"_id": ObjectId(_id)}, {"$set": {"razorpay_order_id": razorpay_order_id}})
+        return {"order_id": _id, "razorpay_order_id": razorpay_order_id, "amount": amount_paise}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 class PaymentVerification(BaseModel):
-    razorpay_order_id: str
-    razorpay_payment_id: str
-    razorpay_signature: str
+    razorpay_order_id: str = Field(..., max_length=64)
+    razorpay_payment_id: str = Field(..., max_length=64)
+    razorpay_signature: str = Field(..., max_length=128)
 
 @app.post("/api/orders/verify")
-def verify_payment(body: PaymentVerification):
+async def verify_payment(body: PaymentVerification = Depends(fast_body(PaymentVerification))):
     if not RAZORPAY_KEY_SECRET:
         return {"status": "skipped", "reason": "Razorpay not configured"}
     try:
-        generated_signature = hmac.new(
-            bytes(RAZORPAY_KEY_SECRET, 'utf-8'),
-            msg=bytes(body.razorpay_order_id + '|' + body.razorpay_payment_id, 'utf-8'),
-            digestmod=hashlib.sha256
-        ).hexdigest()
-        if generated_signature == body.razorpay_signature:
-            db["order"].update_one({"razorpay_order_id": body.razorpay_order_id}, {"$set": {"status": "paid"}})
+        try:
+            expected = bytes.fromhex(body.razorpay_signature)
+        except ValueError:
+            expected = b""  # malformed hex can never match a 32-byte digest
+        # Razorpay ids are ASCII; encoding each side directly skips the
+        # intermediate concatenated str and the UTF-8 pass over it
+        msg = body.razorpay_order_id.encode("ascii") + b"|" + body.razorpay_payment_id.encode("ascii")
+        inner = hashlib.sha256(_HMAC_IPAD + msg).digest()
+        generated = hashlib.sha256(_HMAC_OPAD + inner).digest()
+        if hmac.compare_digest(generated, expected):
+            await db["order"].update_one({"razorpay_order_id": body.razorpay_order_id}, {"$set": {"status": "paid"}})
             return {"status": "success"}
         else:
             raise HTTPException(status_code=400, detail="Invalid signature")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class ReconcilePayload(BaseModel):
+    entries: List[PaymentVerification] = Field(..., max_length=1000)
+
+@app.post("/api/orders/reconcile")
+async def reconcile_payments(payload: ReconcilePayload = Depends(fast_body(ReconcilePayload))):
+    """Verify a batch of signatures (nightly reconciliation) in one request,
+    with a single update_many for every order that checks out"""
+    if not RAZORPAY_KEY_SECRET:
+        return {"status": "skipped", "reason": "Razorpay not configured"}
+    try:
+        sha256 = hashlib.sha256  # hoisted out of the loop
+        verified = []
+        failed = []
+        for entry in payload.entries:
+            try:
+                expected = bytes.fromhex(entry.razorpay_signature)
+            except ValueError:
+                expected = b""
+            msg = entry.razorpay_order_id.encode("ascii") + b"|" + entry.razorpay_payment_id.encode("ascii")
+            inner = sha256(_HMAC_IPAD + msg).digest()
+            if hmac.compare_digest(sha256(_HMAC_OPAD + inner).digest(), expected):
+                verified.append(entry.razorpay_order_id)
+            else:
+                failed.append(entry.razorpay_order_id)
+        if verified:
+            await db["order"].update_many(
+                {"razorpay_order_id": {"$in": verified}}, {"$set": {"status": "paid"}}
+            )
+        return {"verified": verified, "failed": failed}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ---------- POS / Order Management ----------
 class UpdateOrderStatus(BaseModel):
     status: str
 
 @app.get("/api/orders")
-def list_orders(limit: Optional[int] = 100):
+async def list_orders(limit: int = 100, fields: str = DEFAULT_ORDER_FIELDS):
+    projection = _str_id_projection(_parse_fields(fields))
     try:
-        items = get_documents("order", {}, limit)
-        for i in items:
-            i["_id"] = str(i.get("_id"))
-        return items
+        cursor = get_cursor("order", {}, limit,
+                            projection=projection,
+                            batch_size=min(limit, 100))
+        return _ndjson_stream(cursor)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.patch("/api/orders/{order_id}/status")
-def update_order_status(order_id: str, body: UpdateOrderStatus):
+async def update_order_status(order_id: str, body: UpdateOrderStatus):
     try:
-        db["order"].update_one({"_id": ObjectId(order_id)}, {"$set": {"status": body.status}})
+        await db["order"].update_one({"_id": ObjectId(order_id)}, {"$set": {"status": body.status}})
         return {"status": "updated"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -161,25 +432,39 @@ class CreateShipmentPayload(BaseModel):
     provider: str
 
 @app.post("/api/shipments")
-def create_shipment(payload: CreateShipmentPayload):
+async def create_shipment(payload: CreateShipmentPayload = Depends(fast_body(CreateShipmentPayload))):
     try:
         shipment = Shipment(order_id=payload.order_id, provider=payload.provider)
-        _id = create_document("shipment", shipment)
+        _id = await create_document("shipment", shipment)
         return {"shipment_id": _id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class BatchShipmentsPayload(BaseModel):
+    items: List[CreateShipmentPayload]
+
+@app.post("/api/shipments/batch")
+async def create_shipments_batch(payload: BatchShipmentsPayload = Depends(fast_body(BatchShipmentsPayload))):
+    try:
+        shipments = [Shipment(order_id=x.order_id, provider=x.provider) for x in payload.items]
+        # One insert_many wire message instead of N round-trips
+        ids = await create_documents("shipment", shipments)
+        return {"shipment_ids": ids}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/shipments")
-def list_shipments(limit: Optional[int] = 100):
+async def list_shipments(limit: int = 100, fields: str = DEFAULT_SHIPMENT_FIELDS):
+    projection = _str_id_projection(_parse_fields(fields))
     try:
-        items = get_documents("shipment", {}, limit)
-        for i in items:
-            i["_id"] = str(i.get("_id"))
-        return items
+        cursor = get_cursor("shipment", {}, limit,
+                            projection=projection,
+                            batch_size=min(limit, 100))
+        return _ndjson_stream(cursor)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="uvloop", http="httptools")
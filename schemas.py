@@ -11,13 +11,15 @@ Model name is converted to lowercase for the collection name:
 - BlogPost -> "blogs" collection
 """
 
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, ConfigDict, Field, HttpUrl
 from typing import Optional, List, Literal
 from datetime import datetime
 
 # Typography note: Schemas define data shape only.
 
 class User(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     name: str = Field(..., description="Full name")
     email: str = Field(..., description="Email address")
     address: Optional[str] = Field(None, description="Address")
@@ -29,6 +31,8 @@ class Product(BaseModel):
     Perfume products
     Collection name: "product"
     """
+    model_config = ConfigDict(extra="ignore")
+
     title: str = Field(..., description="Product title")
     brand: Optional[str] = Field("", description="Brand name")
     description: Optional[str] = Field(None, description="Product description")
@@ -42,6 +46,8 @@ class Product(BaseModel):
     in_stock: bool = Field(True, description="Stock availability")
 
 class OrderItem(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     product_id: str = Field(..., description="Product _id as string")
     title: str = Field(..., description="Product title snapshot")
     size_ml: int = Field(..., description="Selected size in ml")
@@ -49,14 +55,16 @@ class OrderItem(BaseModel):
     quantity: int = Field(..., ge=1, description="Quantity")
 
 class Order(BaseModel):
-    customer_name: str
-    customer_email: str
-    customer_phone: str
-    shipping_address: str
-    items: List[OrderItem]
+    model_config = ConfigDict(extra="ignore")
+
+    customer_name: str = Field(..., max_length=200)
+    customer_email: str = Field(..., max_length=254)
+    customer_phone: str = Field(..., max_length=20)
+    shipping_address: str = Field(..., max_length=1000)
+    items: List[OrderItem] = Field(..., max_length=200)
     subtotal: float = Field(..., ge=0)
     shipping_fee: float = Field(0, ge=0)
-    total_amount: float = Field(..., ge=0)
+    total_amount: int = Field(..., ge=0, description="Total in paise")
     currency: Literal["INR"] = "INR"
     status: Literal["pending", "paid", "processing", "shipped", "delivered", "cancelled"] = "pending"
     razorpay_order_id: Optional[str] = None
@@ -66,6 +74,8 @@ class Order(BaseModel):
     updated_at: Optional[datetime] = None
 
 class Shipment(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     order_id: str
     provider: Literal["shiprocket", "delhivery", "bluedart", "xpressbees", "other"] = "other"
     tracking_id: Optional[str] = None